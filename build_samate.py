@@ -33,16 +33,20 @@
 # TODO: SAMATE for C# exists as well, though I don't think we've ever used it.
 
 import argparse
+import concurrent.futures
 import multiprocessing
 import os
 import platform
-import re
 import shutil
 import subprocess
 import sys
 import threading
 import time
 
+# chunks of more than this many source files are passed to the compiler in a response file rather than on
+# the command line (which keeps the command line short, Windows limits it to 32767 characters)
+RESPONSE_FILE_MIN = 32
+
 def is_windows():
 	'''Whether we appear to be running on Windows.'''
 	if platform.system() == 'Windows':
@@ -51,138 +55,194 @@ def is_windows():
 		return True
 	return False
 
+def remove_tree(root):
+	'''Remove a directory tree if it exists (like `shutil.rmtree(root, ignore_errors = True)`, but deleting
+	files in parallel).'''
+	if is_windows():
+		# parallel deletes tend to contend with each other on NTFS
+		shutil.rmtree(root, ignore_errors = True)
+		return
+
+	try:
+		files = []
+		subdirs = []
+		with os.scandir(root) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks = False):
+					subdirs.append(entry.path)
+				else:
+					files.append(entry.path)
+		with concurrent.futures.ThreadPoolExecutor(max_workers = 32) as executor:
+			list(executor.map(os.unlink, files))
+		for subdir in subdirs:
+			remove_tree(subdir)
+		os.rmdir(root)
+	except OSError:
+		# doesn't exist, or something unexpected; fall back on doing it the slow way
+		shutil.rmtree(root, ignore_errors = True)
+
 def plural(num):
-	if num == 1:
-		return ""
-	else:
-		return "s"
-
-class Jobs:
-	'''A very simple thread pool.'''
-	def __init__(self, threads):
-		self.slots = threading.Semaphore(threads)
-		self.outstanding_jobs = []
-		self.errors = []
-	
-	def start_job(self, job):
-		'''Start running a job (in a thread).'''
-		def do_job():
-			try:
-				job.do()
-			except Exception as e:
-				self.errors.append(e)
-				raise
-			finally:
-				self.slots.release()
-
-		self.slots.acquire()
-		thread = threading.Thread(target = do_job)
-		thread.start()
-		self.outstanding_jobs.append(thread)
-
-	def has_errors(self):
-		return bool(self.errors)
-
-	def wait_jobs(self):
-		'''Wait until all outstanding jobs are complete.'''
-		for job in self.outstanding_jobs:
-			job.join()
-		self._outstanding_jobs = []
-		if len(self.errors) > 0:
-			print("*** exceptions occurred in " + str(len(self.errors)) + " threads:")
-			print(str(self.errors))
-			print("")
-			raise Exception("Exception in thread(s).")
-
-def find_all_testcases_rec(search_dir, dirs_regexp, files_regexp, cwes_include, cwes_exclude, for_gcc):
-	'''Recursive part of find_all_testcases.'''
-	results = list()
+	'''The suffix for a plural of `num` things ("" or "s").'''
+	return "" if num == 1 else "s"
 
-	# for each child of this directory...
-	for child in os.listdir(search_dir):
-		child_path = os.path.join(search_dir, child)
+def cwe_number(name):
+	'''The CWE number from a name of the form `CWE000_...` (as a string), or None if the name is not of
+	that form.'''
+	# (plain string operations, these are quite a bit cheaper than a regexp match)
+	if name.startswith("CWE"):
+		number, separator, _ = name[3:].partition("_")
+		if separator and number.isdigit() and number.isascii():
+			return number
+	return None
+
+def find_all_testcases_rec(search_dir, language, check_include, check_exclude, for_gcc):
+	'''Recursive part of find_all_testcases (a generator).'''
 
-		if os.path.isdir(child_path):
-			# a directory; check against dirs_regexp and `cwes_exclude`
-			dir_match = dirs_regexp.match(child)
-			if dir_match:
+	# hoist lookups out of the loop (this is the hot part of the scan)
+	find_build_files = (language == "java")
+
+	# for each child of this directory...
+	# (`os.scandir` gives us the type of each entry without an extra `stat` per child)
+	with os.scandir(search_dir) as entries:
+		for entry in entries:
+			child = entry.name
+
+			if entry.is_dir(follow_symlinks = False):
+				# a directory; check the name is one we explore (see `find_all_testcases`) and against
+				# `check_include` / `check_exclude`
 				recurse_in = False
 				report = False
 
-				if dir_match.group(1):
+				cwe = cwe_number(child)
+				if cwe:
 					# CWE-labelled directory
-					if dir_match.group(1) in cwes_include or not cwes_include:
+					if check_include(cwe):
 						recurse_in = True
 						report = True
-					if dir_match.group(1) in cwes_exclude:
+					if check_exclude(cwe):
 						recurse_in = False
-				else:
-					# non-CWE labelled directory (i.e. subdivision directory)
+				elif child.startswith("s") and child[1:].isdigit() and child.isascii():
+					# subdivision directory
 					recurse_in = True
 
 				if recurse_in:
 					# recurse in
-					new_results = find_all_testcases_rec(child_path, dirs_regexp, files_regexp, cwes_include, cwes_exclude, for_gcc)
+					new_results = find_all_testcases_rec(entry.path, language, check_include, check_exclude, for_gcc)
 					if report:
-						print("    found CWE " + dir_match.group(1) + " with " + str(len(new_results)) + " test sources")
-					results += new_results
-
-		if os.path.isfile(child_path):
-			# a file; check against `files_regexp`
-			file_match = files_regexp.match(child)
-			if file_match:
-				if (child == "CWE397_Throw_Generic_Exception__declare_dotdotdot_w32_01.cpp" and for_gcc):
-					# this test-case is "windows specific" according to it's own comments, and won't
-					# build in gcc.
-					print("  excluding '" + child + "' because that test case explicitly does not work in gcc.")
+						count = 0
+						for result in new_results:
+							count += 1
+							yield result
+						print("    found CWE " + cwe + " with " + str(count) + " test sources")
+					else:
+						yield from new_results
+
+			elif entry.is_file(follow_symlinks = False):
+				# a file; check it's one we build (see `find_all_testcases`)
+				if find_build_files:
+					is_testcase = (child == "build.xml")
 				else:
-					# add to results
-					results.append(child_path)
-
-	return results
+					is_testcase = child.endswith((".c", ".cpp")) and cwe_number(child) is not None
+				if is_testcase:
+					if (child == "CWE397_Throw_Generic_Exception__declare_dotdotdot_w32_01.cpp" and for_gcc):
+						# this test-case is "windows specific" according to it's own comments, and won't
+						# build in gcc.
+						print("  excluding '" + child + "' because that test case explicitly does not work in gcc.")
+					else:
+						# add to results
+						yield entry.path
 
 def find_all_testcases(args):
-	'''Find all testcase source files in a search directory'''
+	'''Find all testcase source files in a search directory (a generator, so that building can start
+	before the scan is finished).'''
 
-	# regexp for directories to explore
-	#  - directories of the form `CWE000...`, where 000 is a CWE we are interested in
+	# directories that `find_all_testcases_rec` explores:
+	#  - directories of the form `CWE000_...`, where 000 is a CWE we are interested in
 	#  - directories of the form `s00`, where 00 is any number (these subdivide some CWE directories)
 	#  - no other directories (in particular not the "antbuild" directories in Juliet Test Suite v1.3 for Java)
-	cwe_dirs_exp = "CWE([0-9]+)_.*"
-	s_dirs_exp = "s[0-9]+"
-	dirs_exp = "^" + cwe_dirs_exp + "|" + s_dirs_exp + "$"
-	dirs_regexp = re.compile(dirs_exp)
-	print("  dirs_exp = " + dirs_exp)
 
-	# regexp for files to build
-	if (args.language == "cpp"):
-		files_exp = "^CWE[0-9]+_.*\.(c|cpp)$" # find source files
-	elif (args.language == "java"):
-		#files_exp = "^CWE[0-9]+_.*\.java$"
-		files_exp = "build\.xml$" # find build files
-	else:
+	# files to build
+	#  - for cpp, source files of the form `CWE000_....c` or `CWE000_....cpp` (not e.g. the `main.cpp` that
+	#    accompanies them)
+	#  - for java, `build.xml` files
+	if (args.language != "cpp" and args.language != "java"):
 		raise Exception("Unknown language (find_all_testcases).")
-	files_regexp = re.compile(files_exp)
-	print("  files_exp = " + files_exp)
 
 	# include / excluded CWEs
 	if args.cwes:
-		cwes_include = set(args.cwes.split(","))
+		cwes_include = frozenset(args.cwes.split(","))
 	else:
-		cwes_include = set()
+		cwes_include = frozenset()
 	if args.exclude:
-		cwes_exclude = set(args.exclude.split(","))
+		cwes_exclude = frozenset(args.exclude.split(","))
+	else:
+		cwes_exclude = frozenset()
+	print("  include = " + str(set(cwes_include)))
+	print("  exclude = " + str(set(cwes_exclude)))
+	if cwes_include:
+		check_include = cwes_include.__contains__
 	else:
-		cwes_exclude = set()
-	print("  include = " + str(cwes_include))
-	print("  exclude = " + str(cwes_exclude))
+		check_include = lambda cwe: True # no CWEs specified means all CWEs
+	check_exclude = cwes_exclude.__contains__
 
 	# recursively find testcases
-	results = find_all_testcases_rec(args.test_cases_dir, dirs_regexp, files_regexp, cwes_include, cwes_exclude, not args.cl)
-	return results
+	count = 0
+	first = None
+	last = None
+	for result in find_all_testcases_rec(args.test_cases_dir, args.language, check_include, check_exclude, not args.cl):
+		if count == 0:
+			first = result
+		last = result
+		count += 1
+		yield result
+	print("  found " + str(count) + " test sources total")
+	if count > 0:
+		print("    from " + str(first))
+		print("    to " + str(last))
+	print("")
+	sys.stdout.flush()
 
-def build_source_files(args, source_paths):
-	'''Build a specified source file.'''
+def chunk_testcases(args, testcases):
+	'''Group testcase source files into chunks that are built by a single compiler invocation (a
+	generator).'''
+	chunk = []
+	count = 0
+	for testcase in testcases:
+		chunk.append(testcase)
+		count += 1
+
+		if (args.language == "java"):
+			chunk_max = 1 # build one file per call
+		else:
+			# build many files per call (compiler startup is expensive); we don't know how many testcases
+			# there are in total until the scan is done, so chunks grow with the number found so far
+			chunk_max = max(50, count // (args.threads * 2))
+		if len(chunk) >= chunk_max:
+			yield chunk
+			chunk = []
+	if len(chunk) >= 1:
+		yield chunk # final 'remainder' chunk
+
+def worker_object_dir(args):
+	'''The directory the current worker (thread / process) puts its own files in, a subdirectory of the
+	object directory.  Each worker has its own so that parallel cl builds aren't all creating objects in
+	one directory (gcc objects go in the object directory itself, see `main`).'''
+	path = os.path.join(args.object_dir, "worker_" + str(os.getpid()) + "_" + str(threading.get_ident()))
+	os.makedirs(path, exist_ok = True)
+	return path
+
+def write_response_file(path, source_paths, for_gcc):
+	'''Write a response file listing the specified source files, for `gcc` or `cl`.'''
+	with open(path, 'w') as f:
+		for source_path in source_paths:
+			if for_gcc:
+				# gcc treats backslashes in response files as escape characters
+				source_path = source_path.replace('\\', '\\\\').replace('"', '\\"')
+			f.write('"' + source_path + '"\n')
+
+def set_cpp_commands(args):
+	'''Compute the parts of the command line for building C/C++ source files that are the same for every
+	build (these are stored in `args`, and must be recomputed if the settings they depend on change).'''
 
 	if args.cases == "good":
 		cases_macro = "OMITBAD"
@@ -193,37 +253,61 @@ def build_source_files(args, source_paths):
 	else:
 		raise Exception("Unknown cases.")
 
+	if args.cl:
+		# construct command line (cl)
+		cmd = [args.cl_path]
+		cmd.append('/I' + args.test_cases_support_dir)
+		if cases_macro:
+			cmd.append("/D" + cases_macro)
+		cmd += ["/W3", "/MT", "/GS", "/RTC1", "/bigobj", "/EHsc", "/nologo"] # same as the .bat files in SAMATE dist
+		cmd.append("/c") # do not link
+		verbose = []
+	else:
+		# construct command line (gcc)
+		cmd = [args.gcc_path]
+		cmd += ["-I", args.test_cases_support_dir]
+		if cases_macro:
+			cmd.append("-D" + cases_macro)
+	
+		# the following have been found missing in particular library versions; defining them here
+		# increases reliability.
+		cmd.append('-DCALG_RC5=(ALG_CLASS_DATA_ENCRYPT|ALG_TYPE_BLOCK|ALG_SID_RC5)') # CALG_RC5 is usually part of 'wincrypt.h'
+		cmd.append("-DNO_ERROR=0L")
+		cmd.append("-D__STDC_FORMAT_MACROS") # Instruct MinGW to include PRId64, SCNd64 etc
+		cmd.append("-c") # do not link
+		cmd += ["-wrapper", "true"] # redirect subcommands to do nothing (speeds things up)
+		# (note: this runs `true` in place of cc1 / cc1plus, so no source is actually parsed; `-fsyntax-only`
+		#  would still run the whole frontend on every file, so it would be slower, not faster.  With
+		#  `-pipe` the assembler is not redirected and writes an empty object to the current directory,
+		#  which is why we build from the object dir)
+		if args.use_pipe:
+			cmd.append("-pipe") # use pipes rather than temporary files (may build 10-20% faster, but doesn't work on every system)
+		verbose = ["-v", "-pass-exit-codes"] # -v = verbose, -pass-exit-codes = may give more detailed exit code
+
+	args.cpp_cmd_prefix = tuple(cmd)
+	args.cpp_cmd_verbose_suffix = tuple(verbose)
+
+def build_source_files(args, source_paths):
+	'''Build a specified chunk of source files.'''
+
+	response_file_path = None
+	if (args.language == "cpp") and (len(source_paths) > RESPONSE_FILE_MIN):
+		# pass a long list of sources in a response file
+		# (it's in this worker's object directory and named after the first source in the chunk, so no other
+		#  build uses the same one; it's kept if the build fails)
+		response_file_path = os.path.join(worker_object_dir(args), os.path.basename(source_paths[0]) + ".rsp")
+		write_response_file(response_file_path, source_paths, not args.cl)
+		sources = ["@" + response_file_path]
+	else:
+		sources = source_paths
+
 	if (args.language == "cpp"):
+		# (everything but the output directory and sources is precomputed by `set_cpp_commands`)
+		cmd = list(args.cpp_cmd_prefix)
 		if args.cl:
-			# construct command line (cl)
-			cmd = [str(args.cl_path)]
-			cmd.append('/I' + args.test_cases_support_dir)
-			if cases_macro:
-				cmd.append("/D" + cases_macro)
-			cmd += ["/W3", "/MT", "/GS", "/RTC1", "/bigobj", "/EHsc", "/nologo"] # same as the .bat files in SAMATE dist
-			cmd.append("/c") # do not link
-			for source_path in source_paths:
-				cmd.append(source_path)
-			verbose = []
-		else:
-			# construct command line (gcc)
-			cmd = [str(args.gcc_path)]
-			cmd += ["-I", args.test_cases_support_dir]
-			if cases_macro:
-				cmd.append("-D" + cases_macro)
-		
-			# the following have been found missing in particular library versions; defining them here
-			# increases reliability.
-			cmd.append('-DCALG_RC5=(ALG_CLASS_DATA_ENCRYPT|ALG_TYPE_BLOCK|ALG_SID_RC5)') # CALG_RC5 is usually part of 'wincrypt.h'
-			cmd.append("-DNO_ERROR=0L")
-			cmd.append("-D__STDC_FORMAT_MACROS") # Instruct MinGW to include PRId64, SCNd64 etc
-			cmd.append("-c") # do not link
-			cmd += ["-wrapper", "true"] # redirect subcommands to do nothing (speeds things up)
-			if args.use_pipe:
-				cmd.append("-pipe") # use pipes rather than temporary files (may build 10-20% faster, but doesn't work on every system)
-			for source_path in source_paths:
-				cmd.append(source_path)
-			verbose = ["-v", "-pass-exit-codes"] # -v = verbose, -pass-exit-codes = may give more detailed exit code
+			cmd.append("/Fo" + worker_object_dir(args) + os.sep) # put objects in this worker's directory
+		cmd += sources
+		verbose = list(args.cpp_cmd_verbose_suffix)
 	elif (args.language == "java"):
 		print("build " + str(source_paths))
 		cmd = [args.ant_path]
@@ -238,14 +322,17 @@ def build_source_files(args, source_paths):
 
 	# execute command line (with as little overhead as we can)
 	#print('  exec: "' + str(cmd) + '"') # --- report every compiler invocation (affects performance)
-	with open(os.devnull, 'w') as devnull:
-		rtn = subprocess.call(cmd, stdout = devnull, stderr = devnull)
+	# (we don't need the compiler to close inherited file descriptors: Python creates them non-inheritable)
+	# (don't pass `cwd`, `preexec_fn`, `shell` etc. here, they stop `subprocess` from using `posix_spawn`)
+	rtn = subprocess.call(cmd, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, close_fds = False)
 
 	# if it fails, execute the command again but with maximum verbosity (for debugging); then fail
 	if rtn != 0:
 		args.output_mutex.acquire() # avoid getting errors from different threads garbled
 		print("*** FAILED BUILD:")
 		print('exec: "' + str(cmd + verbose) + '"')
+		if response_file_path:
+			print("(" + str(len(source_paths)) + " sources, listed in '" + response_file_path + "')")
 		print("")
 		sys.stdout.flush() # try to get output in the right order
 		rtn2 = subprocess.call(cmd + verbose, stderr = subprocess.STDOUT)
@@ -256,16 +343,55 @@ def build_source_files(args, source_paths):
 		args.output_mutex.release()
 
 		# raise exception
-		raise Exception("Build '" + source_path + "' failed.")
-
-class build_source_files_job:
-	'''Build a specified source file (as a job).'''
-	def __init__(self, args, source_paths):
-		self.args = args
-		self.source_paths = source_paths
-
-	def do(self):
-		build_source_files(self.args, self.source_paths)
+		raise Exception("Build '" + source_paths[-1] + "' failed.")
+
+	if response_file_path:
+		os.unlink(response_file_path)
+
+# configuration for `build_source_files_worker` (set once per worker by `init_build_worker`)
+worker_args = None
+
+def init_build_worker(args):
+	'''Initialize a worker thread / process for `build_source_files_worker`.'''
+	global worker_args
+	worker_args = args
+
+def build_source_files_worker(source_paths):
+	'''Build a specified chunk of source files (in a worker thread / process).  Only the chunk is sent with
+	each job; `args` is sent to each worker once, when it starts.'''
+	build_source_files(worker_args, source_paths)
+
+def build_chunks(executor, chunks, max_pending):
+	'''Build chunks of source files in a worker pool, stopping at the first failure.  At most
+	`max_pending` chunks are submitted and not yet built at any time.'''
+	# (chunks are submitted as the scan produces them, so building overlaps with scanning; if a chunk fails
+	#  we stop scanning rather than submit chunks that will only be dropped)
+	failed = threading.Event()
+	def on_done(future):
+		if not future.cancelled() and future.exception():
+			failed.set()
+
+	with executor:
+		pending = set()
+		try:
+			for chunk in chunks:
+				if failed.is_set():
+					break
+				if len(pending) >= max_pending:
+					# wait for a chunk to be built before scanning further (this keeps memory use flat)
+					done, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+					for future in done:
+						future.result() # re-raises any failure
+				future = executor.submit(build_source_files_worker, chunk)
+				future.add_done_callback(on_done)
+				pending.add(future)
+			for future in concurrent.futures.as_completed(pending):
+				future.result() # re-raises any failure
+		except:
+			# stop at the first failure (chunks that haven't started yet are dropped)
+			for future in pending:
+				future.cancel()
+			raise
 
 def main():
 	time_start = time.time()
@@ -303,6 +429,8 @@ def main():
 		default_threads = 9 # high guess, as excessive threads don't seem to hurt performance much
 	arg_parser.add_argument('--threads', dest='threads', type=int, required=False,
 							metavar='NUM', help='number of threads, use 1 for better determinism and cleaner output (default: auto)', default = default_threads)
+	arg_parser.add_argument('--threads-mode', dest='threads_mode', choices=["process", "thread"], required=False,
+							metavar='MODE', help='run parallel builds in worker processes or threads ("process" or "thread"; default: process)', default = "process")
 	if is_windows():
 		default_gcc = "gcc"
 	else:
@@ -343,45 +471,40 @@ def main():
 
 	# ensure temp. object directory exists
 	args.object_dir = os.path.join(args.output_dir, "object")
-	shutil.rmtree(args.object_dir, ignore_errors = True)
+	remove_tree(args.object_dir)
 	if not os.path.isdir(args.object_dir):
 		os.makedirs(args.object_dir)
 
 	# find gcc / cl (note: if `args.cl` is set, we will use `cl`; otherwise we will use `gcc`)
+	# (these are made absolute strings once here, which among other things lets `subprocess` use
+	#  `posix_spawn`)
 	if (args.language == "cpp"):
 		if args.gcc:
 			args.gcc_path = shutil.which(args.gcc)
 			if not args.gcc_path:
 				raise Exception("Could not locate gcc.")
+			args.gcc_path = os.path.abspath(args.gcc_path)
 		if args.cl:
 			args.cl_path = shutil.which(args.cl)
 			if not args.cl_path:
 				raise Exception("Could not locate cl.")
+			args.cl_path = os.path.abspath(args.cl_path)
 	if (args.language == "java"):
 		args.ant_path = shutil.which("ant")
 		if not args.ant_path:
 			raise Exception("Could not locate ant.")
+		args.ant_path = os.path.abspath(args.ant_path)
+	if platform.system() == 'Linux' and not getattr(subprocess, '_USE_POSIX_SPAWN', False):
+		print("note: `subprocess` will not use `posix_spawn` on this system, builds may be slower.")
+		print("")
 
 	# other initialization (the `args` structure is abused to store general configuration)
-	args.output_mutex = threading.Semaphore(1)
+	args.output_mutex = threading.Lock()
 	args.use_pipe = True
 	if args.cl:
 		args.use_pipe = False # no such setting
-
-	# find testcases
-	# (strictly speaking we're finding / building / reporting test case source files, not test cases; in
-	#  some cases there is more than one source file corresponding to a particular test case, e.g. good
-	#  and bad variants in separate files)
-	time_find_start = time.time()
-	print("scanning SAMATE test cases...")
-	sys.stdout.flush()
-	testcases = find_all_testcases(args)
-	print("  found " + str(len(testcases)) + " test sources total")
-	if len(testcases) > 0:
-		print("    from " + str(testcases[0]))
-		print("    to " + str(testcases[len(testcases) - 1]))
-	print("")
-	time_find_end = time.time()
+	if (args.language == "cpp"):
+		set_cpp_commands(args)
 
 	# find support files (any that need building)
 	if (args.language == "cpp"):
@@ -392,7 +515,7 @@ def main():
 
 	# start building
 	original_dir = os.getcwd()
-	os.chdir(args.object_dir) # build from the object dir, so that outputs are put there
+	os.chdir(args.object_dir) # build from the object dir, so that outputs (other than from cl) are put there
 	time_build_start = time.time()
 
 	# build support files (in a loop, backing off settings each time it fails...)
@@ -411,47 +534,38 @@ def main():
 					print("trying without `-pipe`...")
 					print("")
 					args.use_pipe = False
+					set_cpp_commands(args)
 				else:
 					# fail
 					raise
 
-	# build testcases (ideally in chunks and in parallel)
-	print("building test cases (" + str(args.threads) + " thread" + plural(args.threads) + " / " + str(cpu_count) + " CPU" + plural(cpu_count) + ")...")	
-	print("")
+	time_support_end = time.time()
+
+	# find and build testcases (ideally in chunks and in parallel; chunks are built as soon as the scan
+	# finds them)
+	# (strictly speaking we're finding / building / reporting test case source files, not test cases; in
+	#  some cases there is more than one source file corresponding to a particular test case, e.g. good
+	#  and bad variants in separate files)
+	print("scanning SAMATE test cases and building them (" + str(args.threads) + " thread" + plural(args.threads) + " / " + str(cpu_count) + " CPU" + plural(cpu_count) + ")...")	
 	sys.stdout.flush()
-	if args.threads >= 1:
-		jobs = Jobs(args.threads)
-	else:
+	if args.threads < 1:
 		raise Exception("'threads' argument is non-positive.")
-	chunk = []
-	chunk_size = 0
-	if (args.language == "java"):
-		chunk_max = 1 # build one file per call
-	else:
-		chunk_max = min(50, round(len(testcases) / args.threads)) # build multiple files per call
-	for testcase in testcases:
-		chunk.append(testcase)
-		chunk_size += 1
-
-		if chunk_size >= chunk_max:
-			if args.threads == 1:
-				# the simple way, for maximum determinism
-				build_source_files(args, chunk)
-			else:
-				# the threaded way, for maximum performance
-				jobs.start_job(build_source_files_job(args, chunk))
-
-				if jobs.has_errors(): # stop submitting jobs if we hit an error
-					break
-			chunk = []
-			chunk_size = 0
-	if chunk_size >= 1:
-		# run final 'remainder' chunk
-		if args.threads == 1:
+	chunks = chunk_testcases(args, find_all_testcases(args))
+	if args.threads == 1:
+		# the simple way, for maximum determinism
+		for chunk in chunks:
 			build_source_files(args, chunk)
-		else:
-			jobs.start_job(build_source_files_job(args, chunk))
-	jobs.wait_jobs()
+	elif args.threads_mode == "thread":
+		# the threaded way
+		build_chunks(concurrent.futures.ThreadPoolExecutor(max_workers = args.threads,
+			initializer = init_build_worker, initargs = (args,)), chunks, args.threads * 2)
+	else:
+		# the multi-process way, for maximum performance (each worker has its own GIL)
+		# (`args` is sent to the workers, so it needs a lock that can be shared between processes)
+		process_args = argparse.Namespace(**vars(args))
+		process_args.output_mutex = multiprocessing.Lock()
+		build_chunks(concurrent.futures.ProcessPoolExecutor(max_workers = args.threads,
+			initializer = init_build_worker, initargs = (process_args,)), chunks, args.threads * 2)
 
 	# done building
 	print("all testcases built.")
@@ -465,12 +579,12 @@ def main():
 	# report timings
 	time_end = time.time()
 	time_total = time_end - time_start
-	time_find_total = time_find_end - time_find_start
-	time_build_total = time_build_end - time_build_start
-	time_accounted_total = time_find_total + time_build_total
+	time_support_total = time_support_end - time_build_start
+	time_build_total = time_build_end - time_support_end
+	time_accounted_total = time_support_total + time_build_total
 	print("total time: " + "{0:.1f}".format(time_total) + "s")
-	print("  finding testcases: " + "{0:.1f}".format(time_find_total) + "s")
-	print("  building sources: " + "{0:.1f}".format(time_build_total) + "s")
+	print("  building support files: " + "{0:.1f}".format(time_support_total) + "s")
+	print("  finding and building testcases: " + "{0:.1f}".format(time_build_total) + "s")
 	print("  unaccounted for: " + "{0:.1f}".format(time_total - time_accounted_total) + "s")
 	print("")
 